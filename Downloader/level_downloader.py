@@ -5,31 +5,154 @@ Downloads all available MRG level files from gdtr.net
 """
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import time
+import hashlib
 import os
 from pathlib import Path
 from typing import List, Dict, Any
 import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    import orjson
+except ImportError:  # Optional, falls back to the standard json module
+    orjson = None
+
+
+class RateLimiter:
+    """Spaces out calls made from any number of threads to one per interval seconds"""
+
+    def __init__(self, interval: float = 0):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """Wake up all waiting callers and refuse any further calls"""
+        self._cancelled.set()
+
+    def wait(self) -> bool:
+        """Block until the caller's turn comes up, returning False if cancelled"""
+        if self.interval <= 0:
+            return not self._cancelled.is_set()
+
+        # Reserve the next free slot under the lock, then sleep outside it
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + self.interval
+
+        if slot > now:
+            self._cancelled.wait(slot - now)
+
+        return not self._cancelled.is_set()
 
 
 class GDLevelsDownloader:
     """Downloads Gravity Defied levels from gdtr.net"""
 
-    def __init__(self, output_dir: str = "levels"):
+    def __init__(self, output_dir: str = "levels", cache_ttl: float = 3600, workers: int = 8):
         self.api_url = "http://gdtr.net/api.php"
         self.mrg_url_template = "http://gdtr.net/mrg/{}.mrg"
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(exist_ok=True)
 
+        # Files already in the output directory, scanned once instead of a stat per download
+        self._existing = {entry.name for entry in os.scandir(self.output_dir) if entry.is_file()}
+
         # Request headers to look like the mobile app
         self.headers = {
             'User-Agent': 'GravityDefied/1.1.1 (Android)',
             'Accept': 'application/json'
         }
 
+        # One pooled session so every request to gdtr.net reuses keep-alive connections
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        self._mount_adapter(workers)
+
+        # API responses are cached in memory for this run and on disk for cache_ttl seconds
+        self.cache_dir = self.output_dir / ".api_cache"
+        self.cache_ttl = cache_ttl
+        self._api_cache = {}
+
+        # Index of the API format that last worked, tried first on later pages
+        self._working_format = None
+
+        # Shared by all download threads, set from the delay in download_all_levels
+        self._rate_limiter = RateLimiter()
+
+    def _mount_adapter(self, workers: int):
+        """Mount a pooling adapter with room for one connection per worker thread"""
+        self.workers = workers
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=max(32, workers),
+            max_retries=Retry(total=5, backoff_factor=0.3,
+                              status_forcelist=[429, 500, 502, 503, 504])
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def close(self):
+        """Close the underlying HTTP session"""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _api_cache_path(self, offset: int, limit: int, sort: str) -> Path:
+        key = hashlib.sha1(f"{offset}|{limit}|{sort}".encode()).hexdigest()
+        return self.cache_dir / f"{key}.json"
+
+    @staticmethod
+    def _is_levels_page(result: Any) -> bool:
+        return isinstance(result, dict) and 'data' in result
+
     def get_levels_list(self, offset: int = 0, limit: int = 100, sort: str = "popular") -> Dict[str, Any]:
-        """Get list of levels from the API"""
+        """Get list of levels from the API, using cached responses when fresh"""
+        key = (offset, limit, sort)
+        if key in self._api_cache:
+            return self._api_cache[key]
+
+        cache_path = self._api_cache_path(offset, limit, sort)
+        if self.cache_ttl > 0:
+            try:
+                if time.time() - cache_path.stat().st_mtime < self.cache_ttl:
+                    result = json.loads(cache_path.read_bytes())
+                    if self._is_levels_page(result):
+                        print(f"  Using cached API response (offset={offset})")
+                        self._api_cache[key] = result
+                        return result
+            except (OSError, ValueError):
+                pass  # Missing or unreadable cache entry, fetch again
+
+        result = self._fetch_levels_list(offset, limit, sort)
+
+        # Only real pages of levels are cached; errors must be retried next time
+        if not self._is_levels_page(result):
+            return result
+
+        self._api_cache[key] = result
+        if self.cache_ttl > 0:
+            # Write to a temp file and rename so a crash never leaves a partial entry
+            self.cache_dir.mkdir(exist_ok=True)
+            tmp_path = cache_path.with_suffix('.tmp')
+            tmp_path.write_bytes(json.dumps(result).encode('utf-8'))
+            os.replace(tmp_path, cache_path)
+
+        return result
+
+    def _fetch_levels_list(self, offset: int, limit: int, sort: str) -> Dict[str, Any]:
+        """Request a page of levels from the API, trying each known request format"""
         # Try different API formats
         api_formats = [
             # Format 1: Based on Android app code
@@ -49,7 +172,14 @@ class GDLevelsDownloader:
             None  # Will trigger POST request
         ]
 
-        for i, params in enumerate(api_formats):
+        # Try the format that worked last time first, the rest only if it fails
+        order = list(range(len(api_formats)))
+        if self._working_format is not None:
+            order.remove(self._working_format)
+            order.insert(0, self._working_format)
+
+        for i in order:
+            params = api_formats[i]
             try:
                 if params is None:
                     # Try POST request
@@ -59,9 +189,9 @@ class GDLevelsDownloader:
                         'limit': limit,
                         'sort': sort
                     }
-                    response = requests.post(self.api_url, data=data, headers=self.headers, timeout=30)
+                    response = self.session.post(self.api_url, data=data, timeout=30)
                 else:
-                    response = requests.get(self.api_url, params=params, headers=self.headers, timeout=30)
+                    response = self.session.get(self.api_url, params=params, timeout=30)
 
                 print(f"  Trying API format {i + 1}: {response.status_code}")
                 print(f"  URL: {response.url}")
@@ -70,6 +200,7 @@ class GDLevelsDownloader:
                     try:
                         result = response.json()
                         print(f"  Success! Got JSON response")
+                        self._working_format = i
                         return result
                     except json.JSONDecodeError:
                         print(f"  Got response but not JSON: {response.text[:200]}")
@@ -90,7 +221,7 @@ class GDLevelsDownloader:
 
         try:
             # Try to get the levels page
-            response = requests.get(base_url, headers=self.headers, timeout=30)
+            response = self.session.get(base_url, timeout=30)
             response.raise_for_status()
 
             # Look for level URLs in the HTML
@@ -124,42 +255,127 @@ class GDLevelsDownloader:
             filename = f"{level_id}.mrg"
 
         file_path = self.output_dir / filename
+        # Partial downloads go here so an interrupted run never leaves a truncated .mrg
+        tmp_path = file_path.with_suffix(file_path.suffix + '.part')
 
         # Skip if already exists
-        if file_path.exists():
+        if filename in self._existing:
             print(f"  Already exists: {filename}")
             return True
 
         url = self.mrg_url_template.format(level_id)
 
+        # Rate limiting (shared across threads, only for real requests)
+        if not self._rate_limiter.wait():
+            return False
+
         try:
-            response = requests.get(url, headers=self.headers, timeout=30)
-            response.raise_for_status()
+            with self.session.get(url, stream=True, timeout=30) as response:
+                response.raise_for_status()
+
+                # Stream the body to disk instead of holding it all in memory
+                total = 0
+                with open(tmp_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        f.write(chunk)
+                        total += len(chunk)
 
-            # Save the file
-            with open(file_path, 'wb') as f:
-                f.write(response.content)
+            # Only a complete download gets the real name
+            os.replace(tmp_path, file_path)
+            self._existing.add(filename)
 
-            print(f"  Downloaded: {filename} ({len(response.content)} bytes)")
+            print(f"  Downloaded: {filename} ({total} bytes)")
             return True
 
         except requests.exceptions.RequestException as e:
             print(f"  Failed to download {filename}: {e}")
             return False
 
-    def download_all_levels(self, max_levels: int = None, sort: str = "popular", delay: float = 0.5):
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    def _load_metadata(self, metadata_file: Path) -> List[Dict[str, Any]]:
+        """Load metadata saved by a previous run, or an empty list if there is none"""
+        if not metadata_file.exists():
+            return []
+
+        try:
+            return json.loads(metadata_file.read_bytes())
+        except (OSError, ValueError) as e:
+            print(f"Could not read {metadata_file}, starting fresh: {e}")
+            return []
+
+    def _save_metadata(self, metadata_file: Path, all_metadata: List[Dict[str, Any]]):
+        """Write the metadata file atomically (temp file + rename)"""
+        tmp_path = metadata_file.with_suffix('.tmp')
+        if orjson is not None:
+            tmp_path.write_bytes(orjson.dumps(all_metadata, option=orjson.OPT_INDENT_2))
+        else:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(all_metadata, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, metadata_file)
+
+    def _prefetch_pages(self, api_response: Dict[str, Any], limit: int, sort: str,
+                        max_levels: int = None, workers: int = 8):
+        """Fetch all pages after the first concurrently when the API reports a total.
+
+        Results land in the API cache, so the batch loop in download_all_levels
+        picks them up without waiting on the network. Does nothing if the total
+        is unknown, in which case pages are fetched one by one as before.
+        """
+        total = api_response.get('total') or api_response.get('count')
+        try:
+            total = int(total)
+        except (TypeError, ValueError):
+            return
+
+        if max_levels:
+            total = min(total, max_levels)
+
+        offsets = range(limit, total, limit)
+        if not offsets:
+            return
+
+        print(f"Prefetching {len(offsets)} more pages of {total} levels...")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(lambda page_offset: self.get_levels_list(page_offset, limit, sort), offsets))
+
+    def _download_level(self, level_id: int, level_info: Dict[str, Any]):
+        """Download one level from a worker thread, returning (filename, success)"""
+        name = level_info.get('name', f'Unknown_{level_id}')
+        author = level_info.get('author', 'Unknown')
+        print(f"Downloading: {name} by {author} (ID: {level_id})")
+
+        filename = f"{level_id}.mrg"
+        success = self.download_mrg_file(level_id, filename)
+
+        return filename, success
+
+    def download_all_levels(self, max_levels: int = None, sort: str = "popular", delay: float = 0.5,
+                            workers: int = None):
         """Download all available levels"""
         print(f"Starting download to: {self.output_dir.absolute()}")
         print(f"Sort order: {sort}")
+        # Default to the worker count the session was sized for, growing the pool if needed
+        if workers is None:
+            workers = self.workers
+        elif workers > self.workers:
+            self._mount_adapter(workers)
+        print(f"Parallel downloads: {workers}")
+
+        self._rate_limiter = RateLimiter(delay)
 
         offset = 0
         limit = 100
         total_downloaded = 0
         total_failed = 0
 
-        # Create metadata file to track downloads
+        # Create metadata file to track downloads, resuming from a previous run if there is one
         metadata_file = self.output_dir / "levels_metadata.json"
-        all_metadata = []
+        all_metadata = self._load_metadata(metadata_file)
+        downloaded_ids = {metadata['id'] for metadata in all_metadata}
+        if all_metadata:
+            print(f"Resuming: {len(all_metadata)} levels already recorded in {metadata_file.name}")
 
         while True:
             print(f"\nFetching levels batch (offset={offset}, limit={limit})...")
@@ -185,52 +401,87 @@ class GDLevelsDownloader:
             else:
                 levels_data = api_response['data']
 
+                # The first page may tell us how many levels there are; if so,
+                # fetch the remaining pages concurrently into the API cache
+                if offset == 0:
+                    self._prefetch_pages(api_response, limit, sort, max_levels, workers)
+
             if not levels_data:
                 print("No levels in this batch.")
                 break
 
             print(f"Found {len(levels_data)} levels in this batch")
 
-            # Download each level
+            # Collect the levels to download from this batch
+            batch = []
             for level_info in levels_data:
-                if max_levels and total_downloaded >= max_levels:
-                    print(f"\nReached maximum limit of {max_levels} levels.")
-                    break
-
                 level_id = level_info.get('id') or level_info.get('api_id')
-                name = level_info.get('name', f'Unknown_{level_id}')
-                author = level_info.get('author', 'Unknown')
 
                 if not level_id:
                     print(f"  Skipping level with no ID: {level_info}")
                     continue
 
-                print(f"Downloading: {name} by {author} (ID: {level_id})")
-
-                # Try different filename formats
-                filename = f"{level_id}.mrg"
-                success = self.download_mrg_file(level_id, filename)
-
-                if success:
-                    total_downloaded += 1
-                    # Store metadata
-                    metadata = {
-                        'id': level_id,
-                        'name': name,
-                        'author': author,
-                        'filename': filename,
-                        **level_info  # Include all original data
-                    }
-                    all_metadata.append(metadata)
-                else:
-                    total_failed += 1
-
-                # Rate limiting
-                if delay > 0:
-                    time.sleep(delay)
+                batch.append((level_id, level_info))
+
+            if max_levels:
+                batch = batch[:max_levels - total_downloaded]
+
+            # Levels recorded by an earlier run count as downloaded without another request
+            pending = [(level_id, level_info) for level_id, level_info in batch
+                       if level_id not in downloaded_ids]
+            if len(pending) < len(batch):
+                print(f"  Skipping {len(batch) - len(pending)} levels already downloaded")
+                total_downloaded += len(batch) - len(pending)
+            batch = pending
+
+            # Download the batch concurrently, handling results as they finish
+            batch_metadata = [None] * len(batch)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(self._download_level, level_id, level_info): index
+                           for index, (level_id, level_info) in enumerate(batch)}
+
+                try:
+                    for future in as_completed(futures):
+                        index = futures[future]
+                        level_id, level_info = batch[index]
+                        try:
+                            filename, success = future.result()
+                        except Exception as e:
+                            print(f"  Failed to download level {level_id}: {e}")
+                            success = False
+
+                        if success:
+                            total_downloaded += 1
+                            downloaded_ids.add(level_id)
+                            # Store metadata
+                            batch_metadata[index] = {
+                                'id': level_id,
+                                'name': level_info.get('name', f'Unknown_{level_id}'),
+                                'author': level_info.get('author', 'Unknown'),
+                                'filename': filename,
+                                **level_info  # Include all original data
+                            }
+                        else:
+                            total_failed += 1
+
+                except BaseException:
+                    # Interrupted (e.g. Ctrl+C): drop the queued downloads instead of
+                    # letting the executor finish them, and keep what this batch got
+                    self._rate_limiter.cancel()
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    all_metadata.extend(metadata for metadata in batch_metadata if metadata is not None)
+                    self._save_metadata(metadata_file, all_metadata)
+                    raise
+
+            # Keep metadata in batch order regardless of completion order
+            all_metadata.extend(metadata for metadata in batch_metadata if metadata is not None)
+
+            # Checkpoint after every batch so an interrupted run can resume
+            self._save_metadata(metadata_file, all_metadata)
 
             # Check if we should continue (only for API mode, not scraping)
             if max_levels and total_downloaded >= max_levels:
+                print(f"\nReached maximum limit of {max_levels} levels.")
                 break
 
             # If we used scraping, we got all levels at once
@@ -244,8 +495,7 @@ class GDLevelsDownloader:
             offset += limit
 
         # Save metadata
-        with open(metadata_file, 'w', encoding='utf-8') as f:
-            json.dump(all_metadata, f, indent=2, ensure_ascii=False)
+        self._save_metadata(metadata_file, all_metadata)
 
         print(f"\n" + "=" * 50)
         print(f"Download complete!")
@@ -267,22 +517,25 @@ def main():
                         choices=['popular', 'recent', 'oldest', 'tracks'],
                         help='Sort order (default: popular)')
     parser.add_argument('--delay', '-d', type=float, default=0.5,
-                        help='Delay between downloads in seconds (default: 0.5)')
+                        help='Minimum delay between download requests in seconds, across all workers (default: 0.5)')
+    parser.add_argument('--workers', '-w', type=int, default=8,
+                        help='Number of parallel downloads (default: 8)')
+    parser.add_argument('--cache-ttl', type=float, default=3600,
+                        help='Seconds to reuse cached API responses, 0 to disable (default: 3600)')
 
     args = parser.parse_args()
 
-    downloader = GDLevelsDownloader(args.output)
-
-    try:
-        downloader.download_all_levels(
-            max_levels=args.max,
-            sort=args.sort,
-            delay=args.delay
-        )
-    except KeyboardInterrupt:
-        print("\nDownload interrupted by user.")
-    except Exception as e:
-        print(f"\nUnexpected error: {e}")
+    with GDLevelsDownloader(args.output, cache_ttl=args.cache_ttl, workers=args.workers) as downloader:
+        try:
+            downloader.download_all_levels(
+                max_levels=args.max,
+                sort=args.sort,
+                delay=args.delay
+            )
+        except KeyboardInterrupt:
+            print("\nDownload interrupted by user.")
+        except Exception as e:
+            print(f"\nUnexpected error: {e}")
 
 
 if __name__ == "__main__":
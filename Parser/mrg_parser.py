@@ -4,37 +4,293 @@ Simple MRG Track Parser for Gravity Defied
 Extracts raw coordinate points from .mrg files
 """
 
+import os
+import mmap
 import struct
 import json
 import csv
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Tuple, Dict
-from dataclasses import dataclass
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:  # Optional, falls back to the standard json module
+    orjson = None
+
+try:
+    from numba import njit
+except ImportError:  # Optional, the NumPy decoder is used without it
+    njit = None
+
+# Precompiled formats for the fixed-width fields of an MRG file
+_HDR_TRACK = struct.Struct('>I')  # Track count, and the offset of each track
+_TRACK_HEADER = struct.Struct('>4iH')  # Start x/y, finish x/y, point count (after the marker byte)
+# Absolute (x, y) point, read for the first point of every track and for each reset marker
+_S_II = struct.Struct('>2i')
+
+
+class TrackDB:
+    """Columnar storage for the tracks of one or more MRG files.
+
+    The points of all tracks live in two flat int32 arrays, and track i owns
+    xs[offsets[i]:offsets[i + 1]]. Per-track numbers are kept in a structured
+    array, names and source files in plain lists. Indexing or iterating
+    yields Track views.
+    """
+
+    META_DTYPE = np.dtype([('level', 'i1'), ('track_id', 'i4'),
+                           ('start_x', 'i4'), ('start_y', 'i4'),
+                           ('finish_x', 'i4'), ('finish_y', 'i4')])
+
+    def __init__(self, xs: np.ndarray = None, ys: np.ndarray = None, offsets: np.ndarray = None,
+                 meta: np.ndarray = None, names: List[str] = None, source_files: List[str] = None):
+        self.xs = xs if xs is not None else np.empty(0, dtype=np.int32)
+        self.ys = ys if ys is not None else np.empty(0, dtype=np.int32)
+        self.offsets = offsets if offsets is not None else np.zeros(1, dtype=np.int64)
+        self.meta = meta if meta is not None else np.empty(0, dtype=self.META_DTYPE)
+        self.names = names if names is not None else []
+        self.source_files = source_files if source_files is not None else [""] * len(self.names)
+
+    @classmethod
+    def from_parts(cls, names: List[str], meta_rows: List[Tuple], xs_parts: List[np.ndarray],
+                   ys_parts: List[np.ndarray]) -> 'TrackDB':
+        """Build a TrackDB from per-track metadata rows and point arrays"""
+        if not names:
+            return cls()
+
+        offsets = np.zeros(len(xs_parts) + 1, dtype=np.int64)
+        np.cumsum([len(xs) for xs in xs_parts], out=offsets[1:])
+
+        return cls(np.concatenate(xs_parts), np.concatenate(ys_parts), offsets,
+                   np.array(meta_rows, dtype=cls.META_DTYPE), list(names))
+
+    @classmethod
+    def concat(cls, dbs: List['TrackDB']) -> 'TrackDB':
+        """Join several TrackDBs into one, keeping their order"""
+        dbs = [db for db in dbs if len(db)]
+        if not dbs:
+            return cls()
+
+        # Shift each db's offsets past the points of the ones before it
+        offsets = [np.zeros(1, dtype=np.int64)]
+        base = 0
+        for db in dbs:
+            offsets.append(db.offsets[1:] + base)
+            base += len(db.xs)
+
+        return cls(np.concatenate([db.xs for db in dbs]),
+                   np.concatenate([db.ys for db in dbs]),
+                   np.concatenate(offsets),
+                   np.concatenate([db.meta for db in dbs]),
+                   [name for db in dbs for name in db.names],
+                   [source for db in dbs for source in db.source_files])
+
+    def point_slice(self, index: int) -> slice:
+        """Slice of xs/ys holding the points of track index"""
+        return slice(int(self.offsets[index]), int(self.offsets[index + 1]))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, index: int) -> 'Track':
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("track index out of range")
+        return Track(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield Track(self, index)
+
 
-@dataclass
 class Track:
-    """Represents a single track with its raw coordinates"""
-    name: str
-    level: int
-    track_id: int
-    start_x: int
-    start_y: int
-    finish_x: int
-    finish_y: int
-    points: List[Tuple[int, int]]
-    source_file: str = ""  # Which file this track came from
-
-    def __post_init__(self):
-        """Convert start/finish coordinates from file format to raw format"""
-        # Start/finish coordinates are stored as (value << 16) >> 3 in the file
-        # To reverse this: (stored_value << 3) >> 16
-        self.start_x = (self.start_x << 3) >> 16
-        self.start_y = (self.start_y << 3) >> 16
-        self.finish_x = (self.finish_x << 3) >> 16
-        self.finish_y = (self.finish_y << 3) >> 16
-
-        # Points are already in the correct raw format
+    """Represents a single track with its raw coordinates (a view into a TrackDB)"""
+
+    __slots__ = ('_db', '_index')
+
+    def __init__(self, db: TrackDB, index: int):
+        self._db = db
+        self._index = index
+
+    @classmethod
+    def from_values(cls, name: str, level: int, track_id: int, start_x: int, start_y: int,
+                    finish_x: int, finish_y: int, points, source_file: str = "") -> 'Track':
+        """Build a standalone track backed by a one-track TrackDB.
+
+        Takes the same arguments as the old Track dataclass, with start/finish
+        in file format; they are converted to raw format the same way.
+        """
+        points = np.asarray(points, dtype=np.int32).reshape(-1, 2)
+        meta_row = (level, track_id,
+                    (start_x << 3) >> 16, (start_y << 3) >> 16,
+                    (finish_x << 3) >> 16, (finish_y << 3) >> 16)
+        db = TrackDB.from_parts([name], [meta_row], [points[:, 0].copy()], [points[:, 1].copy()])
+        db.source_files[0] = source_file
+        return cls(db, 0)
+
+    @property
+    def name(self) -> str:
+        return self._db.names[self._index]
+
+    @property
+    def source_file(self) -> str:
+        """Which file this track came from"""
+        return self._db.source_files[self._index]
+
+    @source_file.setter
+    def source_file(self, value: str):
+        self._db.source_files[self._index] = value
+
+    @property
+    def level(self) -> int:
+        return int(self._db.meta['level'][self._index])
+
+    @property
+    def track_id(self) -> int:
+        return int(self._db.meta['track_id'][self._index])
+
+    @property
+    def start_x(self) -> int:
+        return int(self._db.meta['start_x'][self._index])
+
+    @property
+    def start_y(self) -> int:
+        return int(self._db.meta['start_y'][self._index])
+
+    @property
+    def finish_x(self) -> int:
+        return int(self._db.meta['finish_x'][self._index])
+
+    @property
+    def finish_y(self) -> int:
+        return int(self._db.meta['finish_y'][self._index])
+
+    @property
+    def points(self) -> np.ndarray:
+        """(N, 2) int32 array of raw (x, y) coordinates.
+
+        Built from the TrackDB columns on every access, so keep a reference when
+        looping over it; writing into the returned array does not change the track.
+        """
+        points = self._db.point_slice(self._index)
+        return np.column_stack((self._db.xs[points], self._db.ys[points]))
+
+    def __repr__(self):
+        points = self._db.point_slice(self._index)
+        return (f"Track(name={self.name!r}, level={self.level}, track_id={self.track_id}, "
+                f"points={points.stop - points.start}, source_file={self.source_file!r})")
+
+
+def _decode_points(buf, pos: int, points_count: int, first_x: int, first_y: int):
+    """Decode the delta-encoded points following the first point of a track.
+
+    Each point is either two signed byte offsets (dx, dy) from the previous
+    point, or a 0xFF marker followed by two big-endian ints giving absolute
+    coordinates. Returns (xs, ys, pos) with pos just past the data.
+    """
+    count = max(points_count, 1)
+
+    # Worst case every point is a 9 byte reset
+    data = buf[pos:pos + 9 * (count - 1)]
+
+    if _decode_points_jit is not None:
+        xs, ys, used = _decode_points_jit(np.frombuffer(data, dtype=np.uint8), count, first_x, first_y)
+    else:
+        xs, ys, used = _decode_points_numpy(data, count, first_x, first_y)
+
+    return xs, ys, pos + used
+
+
+def _decode_points_numpy(data: bytes, count: int, first_x: int, first_y: int):
+    """Vectorised point decoder: runs of offsets are summed with NumPy and only
+    the reset markers are handled one at a time"""
+    xs = np.empty(count, dtype=np.int32)
+    ys = np.empty(count, dtype=np.int32)
+    xs[0] = first_x
+    ys[0] = first_y
+
+    offsets = np.frombuffer(data, dtype=np.int8)
+
+    # A reset marker is a -1 where an x offset is expected, i.e. at an even
+    # distance from the start of the current run of offsets
+    markers = np.flatnonzero(offsets == -1)
+    markers_by_parity = (markers[markers % 2 == 0], markers[markers % 2 == 1])
+
+    i = 1
+    p = 0
+    while i < count:
+        remaining = count - i
+        candidates = markers_by_parity[p % 2]
+        j = np.searchsorted(candidates, p)
+        if j < len(candidates) and candidates[j] < p + 2 * remaining:
+            run = (candidates[j] - p) // 2
+        else:
+            run = remaining
+
+        if run:
+            deltas = offsets[p:p + 2 * run]
+            if len(deltas) < 2 * run:
+                raise ValueError(f"Track data truncated after {i} points")
+            xs[i:i + run] = xs[i - 1] + np.cumsum(deltas[0::2], dtype=np.int32)
+            ys[i:i + run] = ys[i - 1] + np.cumsum(deltas[1::2], dtype=np.int32)
+            i += run
+            p += 2 * run
+
+        if i < count:
+            # Special case: reset and read full coordinates
+            xs[i], ys[i] = _S_II.unpack_from(data, p + 1)
+            i += 1
+            p += 9
+
+    return xs, ys, p
+
+
+def _decode_points_scalar(data: np.ndarray, count: int, first_x: int, first_y: int):
+    """Byte-by-byte point decoder over a uint8 array, written to be compiled by Numba"""
+    xs = np.empty(count, dtype=np.int32)
+    ys = np.empty(count, dtype=np.int32)
+    xs[0] = first_x
+    ys[0] = first_y
+
+    x = first_x
+    y = first_y
+    p = 0
+    for i in range(1, count):
+        if p >= len(data):
+            raise ValueError("Track data truncated")
+
+        x_offset = int(data[p])
+        if x_offset == 0xFF:
+            # Special case: reset and read full coordinates (big-endian ints)
+            if p + 9 > len(data):
+                raise ValueError("Track data truncated")
+            x = (int(data[p + 1]) << 24) | (int(data[p + 2]) << 16) | (int(data[p + 3]) << 8) | int(data[p + 4])
+            y = (int(data[p + 5]) << 24) | (int(data[p + 6]) << 16) | (int(data[p + 7]) << 8) | int(data[p + 8])
+            if x >= 0x80000000:
+                x -= 0x100000000
+            if y >= 0x80000000:
+                y -= 0x100000000
+            p += 9
+        else:
+            # Normal case: signed byte offsets from the current position
+            if p + 2 > len(data):
+                raise ValueError("Track data truncated")
+            y_offset = int(data[p + 1])
+            x += x_offset - 256 if x_offset >= 0x80 else x_offset
+            y += y_offset - 256 if y_offset >= 0x80 else y_offset
+            p += 2
+
+        xs[i] = x
+        ys[i] = y
+
+    return xs, ys, p
+
+
+# Compile the scalar decoder when Numba is installed, otherwise use the NumPy one
+_decode_points_jit = njit(cache=True)(_decode_points_scalar) if njit is not None else None
 
 
 class MRGParser:
@@ -42,30 +298,38 @@ class MRGParser:
 
     def __init__(self, file_path: str):
         self.file_path = Path(file_path)
-        self.tracks: List[Track] = []
+        self.tracks = TrackDB()
 
-    def parse(self) -> List[Track]:
-        """Parse the MRG file and return list of tracks with raw coordinates"""
-        with open(self.file_path, 'rb') as f:
+    def parse(self) -> TrackDB:
+        """Parse the MRG file and return its tracks, with raw coordinates, as a TrackDB"""
+        fd = os.open(self.file_path, os.O_RDONLY)
+        try:
+            buf = mmap.mmap(fd, 0, prot=mmap.PROT_READ)
+        finally:
+            os.close(fd)
+
+        with buf:
             # Read header for 3 levels
             levels_data = []
+            pos = 0
 
             for level in range(3):
                 # Read track count for this level
-                track_count = struct.unpack('>I', f.read(4))[0]  # Big endian int
+                track_count = _HDR_TRACK.unpack_from(buf, pos)[0]  # Big endian int
+                pos += _HDR_TRACK.size
 
                 level_tracks = []
                 for track_id in range(track_count):
                     # Read track metadata
-                    offset = struct.unpack('>I', f.read(4))[0]
+                    offset = _HDR_TRACK.unpack_from(buf, pos)[0]
+                    pos += _HDR_TRACK.size
 
                     # Read track name (null-terminated string)
-                    name_bytes = b""
-                    while True:
-                        byte = f.read(1)
-                        if byte == b'\x00':
-                            break
-                        name_bytes += byte
+                    end = buf.find(b'\x00', pos)
+                    if end == -1:
+                        raise ValueError(f"Unterminated track name at offset {pos}")
+                    name_bytes = buf[pos:end]
+                    pos = end + 1
 
                     name = name_bytes.decode('cp1251', errors='ignore').replace('_', ' ')
                     level_tracks.append((offset, name, track_id))
@@ -73,159 +337,163 @@ class MRGParser:
                 levels_data.append(level_tracks)
 
             # Now read track data at each offset
+            names, meta_rows, xs_parts, ys_parts = [], [], [], []
             for level, level_tracks in enumerate(levels_data):
                 for offset, name, track_id in level_tracks:
-                    f.seek(offset)
-                    track = self._parse_track(f, name, level, track_id)
+                    track = self._parse_track(buf, offset, name, level, track_id)
                     if track:
-                        self.tracks.append(track)
+                        meta_row, xs, ys = track
+                        names.append(name)
+                        meta_rows.append(meta_row)
+                        xs_parts.append(xs)
+                        ys_parts.append(ys)
 
+        self.tracks = TrackDB.from_parts(names, meta_rows, xs_parts, ys_parts)
         return self.tracks
 
-    def _parse_track(self, f, name: str, level: int, track_id: int) -> Track:
-        """Parse individual track data"""
+    def _parse_track(self, buf, pos: int, name: str, level: int, track_id: int):
+        """Parse individual track data starting at offset pos of buf.
+
+        Returns (meta_row, xs, ys) for TrackDB, or None if the track is invalid.
+        """
         try:
             # Check track marker
-            marker = struct.unpack('B', f.read(1))[0]
+            marker = buf[pos]
+            pos += 1
             if marker != 0x33:
                 print(f"Warning: Invalid track marker {marker:02x} for {name}")
                 return None
 
-            # Read track properties
-            start_x = struct.unpack('>i', f.read(4))[0]
-            start_y = struct.unpack('>i', f.read(4))[0]
-            finish_x = struct.unpack('>i', f.read(4))[0]
-            finish_y = struct.unpack('>i', f.read(4))[0]
-            points_count = struct.unpack('>H', f.read(2))[0]  # Short
+            # Read track properties in one go
+            start_x, start_y, finish_x, finish_y, points_count = _TRACK_HEADER.unpack_from(buf, pos)
+            pos += _TRACK_HEADER.size
 
             # Debug info
             print(f"    Track: {name}, Points: {points_count}")
 
             # Read first point
-            first_x = struct.unpack('>i', f.read(4))[0]
-            first_y = struct.unpack('>i', f.read(4))[0]
+            first_x, first_y = _S_II.unpack_from(buf, pos)
+            pos += _S_II.size
 
             # For now, let's skip the transformation and just use raw coordinates
             # Apply unpackInt transformation to first point
             # transformed_x = (first_x << 16) >> 3
             # transformed_y = (first_y << 16) >> 3
-            points = [(first_x, first_y)]
-
-            # Keep track of accumulated raw coordinates for offset calculation
-            current_x = first_x
-            current_y = first_y
+            xs, ys, pos = _decode_points(buf, pos, points_count, first_x, first_y)
 
             # Debug first few points
-            debug_points = min(5, points_count - 1)
             print(f"      First point: raw({first_x}, {first_y})")
+            for i in range(1, min(6, len(xs))):
+                print(f"      Point {i}: raw({xs[i]}, {ys[i]})")
+
+            # Start/finish coordinates are stored as (value << 16) >> 3 in the file
+            # To reverse this: (stored_value << 3) >> 16
+            # Points are already in the correct raw format
+            meta_row = (level, track_id,
+                        (start_x << 3) >> 16, (start_y << 3) >> 16,
+                        (finish_x << 3) >> 16, (finish_y << 3) >> 16)
 
-            # Read remaining points
-            for i in range(1, points_count):
-                x_offset = struct.unpack('b', f.read(1))[0]  # Signed byte
-
-                if x_offset == -1:
-                    # Special case: reset and read full coordinates
-                    current_x = current_y = 0
-                    x = struct.unpack('>i', f.read(4))[0]
-                    y = struct.unpack('>i', f.read(4))[0]
-                    current_x = x
-                    current_y = y
-                    if i <= debug_points:
-                        print(f"      Point {i}: RESET to raw({x}, {y})")
-                else:
-                    # Normal case: read y offset and add to current position
-                    y_offset = struct.unpack('b', f.read(1))[0]  # Signed byte
-                    current_x += x_offset
-                    current_y += y_offset
-                    if i <= debug_points:
-                        print(f"      Point {i}: offset ({x_offset}, {y_offset}) -> raw({current_x}, {current_y})")
-
-                # Just use raw coordinates for now
-                points.append((current_x, current_y))
-
-            return Track(name, level, track_id, start_x, start_y,
-                         finish_x, finish_y, points)
+            return meta_row, xs, ys
 
         except Exception as e:
             print(f"Error parsing track {name}: {e}")
             return None
 
 
-def save_tracks_csv(tracks: List[Track], output_file: str):
+def save_tracks_csv(tracks: TrackDB, output_file: str):
     """Save tracks to CSV with one row per track"""
-    with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
+    # Large write buffer so the file is written in few big chunks
+    with open(output_file, 'w', newline='', encoding='utf-8', buffering=1 << 20) as csvfile:
         writer = csv.writer(csvfile)
 
         # Header
         writer.writerow(['source_file', 'name', 'level', 'track_id', 'start_x', 'start_y',
                          'finish_x', 'finish_y', 'point_count', 'points_x', 'points_y'])
 
-        for track in tracks:
-            points_x = [str(p[0]) for p in track.points]
-            points_y = [str(p[1]) for p in track.points]
-
+        offsets = tracks.offsets.tolist()
+        for i, (level, track_id, start_x, start_y, finish_x, finish_y) in enumerate(tracks.meta.tolist()):
+            start, end = offsets[i], offsets[i + 1]
             writer.writerow([
-                track.source_file,
-                track.name,
-                track.level,
-                track.track_id,
-                track.start_x,
-                track.start_y,
-                track.finish_x,
-                track.finish_y,
-                len(track.points),
-                '|'.join(points_x),  # Pipe-separated coordinates
-                '|'.join(points_y)
+                tracks.source_files[i],
+                tracks.names[i],
+                level,
+                track_id,
+                start_x,
+                start_y,
+                finish_x,
+                finish_y,
+                end - start,
+                '|'.join(map(str, tracks.xs[start:end].tolist())),  # Pipe-separated coordinates
+                '|'.join(map(str, tracks.ys[start:end].tolist()))
             ])
 
 
-def save_tracks_json(tracks: List[Track], output_file: str):
+def save_tracks_json(tracks: TrackDB, output_file: str):
     """Save tracks to JSON with full structure"""
     track_data = []
 
-    for track in tracks:
+    offsets = tracks.offsets.tolist()
+    for i, (level, track_id, start_x, start_y, finish_x, finish_y) in enumerate(tracks.meta.tolist()):
+        start, end = offsets[i], offsets[i + 1]
         track_dict = {
-            'source_file': track.source_file,
-            'name': track.name,
-            'level': track.level,
-            'track_id': track.track_id,
-            'start_x': track.start_x,
-            'start_y': track.start_y,
-            'finish_x': track.finish_x,
-            'finish_y': track.finish_y,
-            'points': track.points
+            'source_file': tracks.source_files[i],
+            'name': tracks.names[i],
+            'level': level,
+            'track_id': track_id,
+            'start_x': start_x,
+            'start_y': start_y,
+            'finish_x': finish_x,
+            'finish_y': finish_y,
+            'points': np.column_stack((tracks.xs[start:end], tracks.ys[start:end]))
         }
         track_data.append(track_dict)
 
-    with open(output_file, 'w', encoding='utf-8') as jsonfile:
-        json.dump(track_data, jsonfile, indent=2, ensure_ascii=False)
+    if orjson is not None:
+        Path(output_file).write_bytes(
+            orjson.dumps(track_data, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
+    else:
+        with open(output_file, 'w', encoding='utf-8') as jsonfile:
+            json.dump(track_data, jsonfile, indent=2, ensure_ascii=False,
+                      default=lambda o: o.tolist())
+
 
+def _parse_one(file_path: str):
+    """Parse a single MRG file in a worker process, returning (stem, tracks, error)"""
+    file_name = Path(file_path).stem
+    try:
+        tracks = MRGParser(file_path).parse()
+    except Exception as e:
+        return file_name, TrackDB(), e
 
-def parse_multiple_files(file_paths: List[str], output_prefix: str = "all_tracks"):
+    # Add file info to each track
+    tracks.source_files = [file_name] * len(tracks)
+
+    return file_name, tracks, None
+
+
+def parse_multiple_files(file_paths: List[str], output_prefix: str = "all_tracks", workers: int = None):
     """Parse multiple MRG files and combine results"""
-    all_tracks = []
+    parsed = []
     failed_files = []
 
     print(f"Parsing {len(file_paths)} MRG files...")
 
-    for i, file_path in enumerate(file_paths, 1):
-        print(f"[{i}/{len(file_paths)}] Parsing {Path(file_path).name}...")
+    # Files are independent, so parse them across processes; map() keeps input order
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        results = executor.map(_parse_one, file_paths, chunksize=16)
 
-        try:
-            parser = MRGParser(file_path)
-            tracks = parser.parse()
+        for i, (file_path, (file_name, tracks, error)) in enumerate(zip(file_paths, results), 1):
+            print(f"[{i}/{len(file_paths)}] Parsed {Path(file_path).name}")
 
-            # Add file info to each track
-            file_name = Path(file_path).stem
-            for track in tracks:
-                track.source_file = file_name
+            if error is not None:
+                print(f"  Failed to parse {file_path}: {error}")
+                failed_files.append(file_path)
+                continue
 
-            all_tracks.extend(tracks)
+            parsed.append(tracks)
             print(f"  Found {len(tracks)} tracks")
 
-        except Exception as e:
-            print(f"  Failed to parse {file_path}: {e}")
-            failed_files.append(file_path)
+    all_tracks = TrackDB.concat(parsed)
 
     print(f"\nTotal tracks parsed: {len(all_tracks)}")
     if failed_files:
@@ -269,6 +537,8 @@ def main():
                         help='Output file prefix (default: all_tracks)')
     parser.add_argument('--recursive', '-r', action='store_true',
                         help='Recursively search directories for MRG files')
+    parser.add_argument('--workers', '-w', type=int,
+                        help='Number of parser processes (default: CPU count)')
 
     # Fallback for simple usage
     if len(sys.argv) == 2 and sys.argv[1].endswith('.mrg'):
@@ -321,7 +591,7 @@ def main():
         return
 
     # Parse all files
-    parse_multiple_files(all_files, args.output)
+    parse_multiple_files(all_files, args.output, args.workers)
 
 
 if __name__ == "__main__":